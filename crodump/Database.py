@@ -191,8 +191,7 @@ class Database:
             for rec in db.enumerate_records(tab):
                 print(sqlformatter(tab, rec))
         """
-        for i in range(self.bank.nrofrecords):
-            data = self.bank.readrec(i + 1)
+        for i, data in enumerate(self.bank.enumrecords()):
             if data and data[0] == table.tableid:
                 try:
                     yield Record(i + 1, table.fields, data[1:])
@@ -206,8 +205,7 @@ class Database:
         Yield all file contents found in CroBank for `table`.
         This is most likely the table with id 0.
         """
-        for i in range(self.bank.nrofrecords):
-            data = self.bank.readrec(i + 1)
+        for i, data in enumerate(self.bank.enumrecords()):
             if data and data[0] == table.tableid:
                 yield i + 1, data[1:]
 
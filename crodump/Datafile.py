@@ -1,9 +1,28 @@
 import io
+import mmap
+import os
 import struct
 import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from .hexdump import tohex, toout
 import crodump.koddecoder
 
+try:
+    # numpy is optional, it speeds up parsing of large .tad indexes.
+    import numpy
+except ImportError:
+    numpy = None
+
+# precompiled format for the 'size, flag' compression chunk header.
+chunkheader = struct.Struct(">HH")
+
+# precompiled formats for the extension block header and chain pointer.
+exthdr32 = struct.Struct("<LL")
+exthdr64 = struct.Struct("<QL")
+extptr32 = struct.Struct("<L")
+extptr64 = struct.Struct("<Q")
+
 class Datafile:
     """Represent a single .dat with it's .tad index file"""
 
@@ -13,6 +32,13 @@ class Datafile:
         self.tad = tad
         self.compact = compact
 
+        try:
+            # map the .dat file so readdata is a slice instead of seek+read.
+            self.datmm = mmap.mmap(self.dat.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError, io.UnsupportedOperation):
+            # empty file, or a file object without a file descriptor.
+            self.datmm = None
+
         self.readdathdr()
         self.readtad()
 
@@ -21,6 +47,29 @@ class Datafile:
 
         self.kod = kod if not kod or self.isencrypted() else crodump.koddecoder.new()
 
+        self.decodefn = self.makedecoder()
+
+    def makedecoder(self):
+        """
+        Build the record decode function specialised for this file.
+        The KOD and compression settings never change after construction,
+        so the per-record branches are resolved once, here.
+        """
+        iscompressed = self.iscompressed
+        decompress = self.decompress
+        if self.encoding & 1 and self.kod:
+            koddecode = self.kod.decode
+
+            def decode(idx, encdat):
+                encdat = koddecode(idx, encdat)
+                chunks = iscompressed(encdat)
+                return decompress(encdat, chunks) if chunks else encdat
+        else:
+            def decode(idx, encdat):
+                chunks = iscompressed(encdat)
+                return decompress(encdat, chunks) if chunks else encdat
+        return decode
+
     def isencrypted(self):
         return self.version in (b'01.04', b'01.05') or self.isv4()
 
@@ -87,30 +136,56 @@ class Datafile:
             raise Exception("unsupported .tad version")
 
         self.tadhdrlen = self.tad.tell()
-        self.tadentrysize = 16 if self.use64bit else 12
-        if self.compact:
-            self.tad.seek(0, io.SEEK_END)
-        else:
-            self.idxdata = self.tad.read()
+        # 01.03 and 01.11 have 64 bit file offsets,
+        # 01.02 and 01.04 have 32 bit offsets.
+        self.tadfmt = struct.Struct("<QLL" if self.use64bit else "<LLL")
+        self.tadentrysize = self.tadfmt.size
+        self.tad.seek(0, io.SEEK_END)
         self.tadsize = self.tad.tell() - self.tadhdrlen
         self.nrofrecords = self.tadsize // self.tadentrysize
         if self.tadsize % self.tadentrysize:
             print("WARN: leftover data in .tad")
 
+        # the entries themselves are loaded on first use, see loadtad.
+        self.idxdata = None
+        self.tadofs = self.tadln = self.tadchk = None
+        self.tadloaded = self.compact
+
+    def loadtad(self):
+        """
+        Read and parse the .tad entries, deferred until the first index
+        lookup so files that are never accessed do not pay for it.
+        """
+        self.tadloaded = True
+        self.tad.seek(self.tadhdrlen)
+        self.idxdata = self.tad.read()
+        if numpy is not None:
+            # parse all entries in one go, instead of one struct.unpack_from per lookup.
+            enttype = numpy.dtype([("ofs", "<u8" if self.use64bit else "<u4"), ("ln", "<u4"), ("chk", "<u4")])
+            tadarr = numpy.frombuffer(self.idxdata, dtype=enttype, count=self.nrofrecords)
+            # split the interleaved view into three contiguous int64 arrays,
+            # so lookups do not stride through the raw entry layout,
+            # and the raw .tad data can be dropped.
+            self.tadofs = tadarr["ofs"].astype(numpy.int64)
+            self.tadln = tadarr["ln"].astype(numpy.int64)
+            self.tadchk = tadarr["chk"].astype(numpy.int64)
+            self.idxdata = None
+
     def tadidx(self, idx):
         """
         If we're not supposed to be more compact but slower, lookup from a cached .tad
         """
+        if not 0 <= idx < self.nrofrecords:
+            raise IndexError("tad index out of range")
         if self.compact:
             return self.tadidx_seek(idx)
+        if not self.tadloaded:
+            self.loadtad()
 
-        if self.use64bit:
-            # 01.03 and 01.11 have 64 bit file offsets
-            return struct.unpack_from("<QLL", self.idxdata, idx * self.tadentrysize)
-        else:
-            # 01.02  and 01.04  have 32 bit offsets.
-           return struct.unpack_from("<LLL", self.idxdata, idx * self.tadentrysize)
+        if self.tadofs is not None:
+            return int(self.tadofs[idx]), int(self.tadln[idx]), int(self.tadchk[idx])
 
+        return self.tadfmt.unpack_from(self.idxdata, idx * self.tadentrysize)
 
     def tadidx_seek(self, idx):
         """
@@ -119,23 +194,53 @@ class Datafile:
         self.tad.seek(self.tadhdrlen + idx * self.tadentrysize)
         idxdata = self.tad.read(self.tadentrysize)
 
-        if self.use64bit:
-            # 01.03 and 01.11 have 64 bit file offsets
-            return struct.unpack("<QLL", idxdata)
+        return self.tadfmt.unpack(idxdata)
+
+    def enumtad(self):
+        """
+        Iterate over all (ofs, ln, chk) index entries in file order.
+        Faster than repeated tadidx calls for sequential scans.
+        """
+        if self.compact:
+            for i in range(self.nrofrecords):
+                yield self.tadidx_seek(i)
+            return
+        if not self.tadloaded:
+            self.loadtad()
+        if self.tadofs is not None:
+            for ofs, ln, chk in zip(self.tadofs, self.tadln, self.tadchk):
+                yield int(ofs), int(ln), int(chk)
         else:
-            # 01.02  and 01.04  have 32 bit offsets.
-           return struct.unpack("<LLL", idxdata)
+            yield from self.tadfmt.iter_unpack(self.idxdata[:self.nrofrecords * self.tadentrysize])
+
+    def advise_sequential(self):
+        """
+        Hint the kernel that the .dat file is about to be read front to
+        back, so it raises readahead for the scan. Silently does nothing
+        where madvise/posix_fadvise are not available.
+        """
+        if self.datmm is not None:
+            if hasattr(self.datmm, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+                self.datmm.madvise(mmap.MADV_SEQUENTIAL)
+        elif hasattr(os, "posix_fadvise"):
+            try:
+                os.posix_fadvise(self.dat.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            except (OSError, io.UnsupportedOperation):
+                pass
 
     def readdata(self, ofs, size):
         """
         Read raw data from the .dat file
         """
+        if self.datmm is not None:
+            return self.datmm[ofs:ofs + size]
         self.dat.seek(ofs)
         return self.dat.read(size)
 
-    def readrec(self, idx):
+    def readrecraw(self, idx):
         """
-        Extract and decode a single record.
+        Read the still encoded contents of a single record,
+        collecting its extension blocks when present.
         """
         if idx == 0:
             raise Exception("recnum must be a positive number")
@@ -164,8 +269,17 @@ class Datafile:
                 extofs, extlen = struct.unpack("<LL", dat[:8])
                 o = 8
 
-            encdat = dat[o:]
-            while len(encdat) < extlen:
+            # assemble the record in a buffer preallocated to the known
+            # final size, so the blocks are copied exactly once.
+            buf = bytearray(extlen)
+            pos = 0
+            chunk = dat[o:]
+            while True:
+                n = min(len(chunk), extlen - pos)
+                buf[pos:pos + n] = chunk[:n]
+                pos += n
+                if pos >= extlen:
+                    break
                 dat = self.readdata(extofs, self.blocksize)
                 if self.use64bit:
                     (extofs,) = struct.unpack("<Q", dat[:8])
@@ -173,34 +287,83 @@ class Datafile:
                 else:
                     (extofs,) = struct.unpack("<L", dat[:4])
                     o = 4
-                encdat += dat[o:]
+                chunk = dat[o:]
+                if not chunk:
+                    # an extension block came back empty: truncated file.
+                    break
 
-            encdat = encdat[:extlen]
+            encdat = bytes(buf)
         else:
             encdat = dat
 
-        if self.encoding & 1:
-            if self.kod:
-                encdat = self.kod.decode(idx, encdat)
+        return encdat
 
-        if self.iscompressed(encdat):
-            encdat = self.decompress(encdat)
+    def decoderec(self, idx, encdat):
+        """
+        KOD decode and decompress raw record contents.
+        """
+        if encdat is None:
+            return
+        return self.decodefn(idx, encdat)
 
-        return encdat
+    def readrec(self, idx):
+        """
+        Extract and decode a single record.
+        """
+        return self.decoderec(idx, self.readrecraw(idx))
+
+    def pipelined(self, items, func):
+        """
+        Apply `func` to `items` on a thread pool, yielding the results in
+        submission order while keeping only a bounded number of items in
+        flight, so arbitrarily large files never fill up memory.
+        """
+        nworkers = os.cpu_count() or 1
+        window = 4 * nworkers
+        with ThreadPoolExecutor(max_workers=nworkers) as pool:
+            pending = deque()
+            for item in items:
+                pending.append(pool.submit(func, item))
+                if len(pending) >= window:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
 
     def enumrecords(self):
-        for i in range(self.nrofrecords):
-            yield self.readrec(i+1)
+        """
+        Yield the decoded contents of all records.
+
+        The .dat reads stay on the calling thread, only the KOD decoding
+        and decompression are done on the thread pool: zlib (and numpy)
+        release the GIL, so records decode in parallel.
+        """
+        self.advise_sequential()
+        rawrecs = ((i + 1, self.readrecraw(i + 1)) for i in range(self.nrofrecords))
+        yield from self.pipelined(rawrecs, lambda rec: self.decoderec(*rec))
 
     def enumunreferenced(self, ranges, filesize):
         """
         From a list of used byte ranges and the filesize, enumerate the list of unused byte ranges
         """
-        o = 0
-        for start, end, desc in sorted(ranges):
-            if start > o:
-                yield o, start - o
-            o = end
+        if numpy is not None and len(ranges) > 1024:
+            # vectorised equivalent of the loop below: sort all ranges at
+            # once and compare each start against the preceding end.
+            arr = numpy.array([(start, end) for start, end, desc in ranges], numpy.int64)
+            order = numpy.lexsort((arr[:, 1], arr[:, 0]))
+            starts = arr[order, 0]
+            ends = arr[order, 1]
+            prev = numpy.empty_like(ends)
+            prev[0] = 0
+            prev[1:] = ends[:-1]
+            for i in numpy.flatnonzero(starts > prev):
+                yield int(prev[i]), int(starts[i] - prev[i])
+            o = int(ends[-1])
+        else:
+            o = 0
+            for start, end, desc in sorted(ranges):
+                if start > o:
+                    yield o, start - o
+                o = end
         if o < filesize:
             yield o, filesize - o
 
@@ -218,78 +381,110 @@ class Datafile:
                 self.encoding, self.blocksize,
                 self.nrdeleted, self.firstdeleted))
 
+        self.advise_sequential()
+
         ranges = []  # keep track of used bytes in the .dat file.
 
-        for i in range(self.nrofrecords):
-            (ofs, ln, chk) = self.tadidx(i)
-            idx = i + 1
-            if args.maxrecs and i==args.maxrecs:
-                break
-            if ln == 0xFFFFFFFF:
-                print("%5d: %08x %08x %08x" % (idx, ofs, ln, chk))
-                continue
-
-            if self.isv3():
-                flags = ln >> 24
-                ln &= 0xFFFFFFF
-            elif self.isv4():
-                flags = ofs >> 56
-                # 04 --> data, v3compdata
-                # 02,03 --> deleted
-                # 00 --> extrec
-                ofs &= (1<<56)-1
-
-            dat = self.readdata(ofs, ln)
-            ranges.append((ofs, ofs + ln, "item #%d" % i))
-            decflags = [" ", " "]
-            infostr = ""
-            tail = b""
-
-            if not dat:
-                # empty record
-                encdat = dat
-            elif not flags:
-                if self.use64bit:
-                    extofs, extlen = struct.unpack("<QL", dat[:12])
-                    o = 12
+        def readraw():
+            """
+            Read the raw contents of all records, yielding one tuple per
+            record with everything formatrec needs.
+            """
+            # hoist the per-file invariants and method lookups out of the
+            # loop, the remaining per-record work is all C-level calls.
+            v3 = self.isv3()
+            use64bit = self.use64bit
+            blocksize = self.blocksize
+            readdata = self.readdata
+            exthdr = exthdr64 if use64bit else exthdr32
+            extptr = extptr64 if use64bit else extptr32
+            hdrlen = 12 if use64bit else 8
+            ptrlen = 8 if use64bit else 4
+
+            for i, (ofs, ln, chk) in enumerate(self.enumtad()):
+                if args.maxrecs and i==args.maxrecs:
+                    break
+                if ln == 0xFFFFFFFF:
+                    yield i, ofs, ln, chk, 0, "", b"", None, None
+                    continue
+
+                if v3:
+                    flags = ln >> 24
+                    ln &= 0xFFFFFFF
                 else:
-                    extofs, extlen = struct.unpack("<LL", dat[:8])
-                    o = 8
-                infostr = "%08x;%08x" % (extofs, extlen)
-                encdat = dat[o:]
-                while len(encdat) < extlen:
-                    dat = self.readdata(extofs, self.blocksize)
-                    ranges.append((extofs, extofs + self.blocksize, "item #%d ext" % i))
-                    if self.use64bit:
-                        (extofs,) = struct.unpack("<Q", dat[:8])
-                        o = 8
-                    else:
-                        (extofs,) = struct.unpack("<L", dat[:4])
-                        o = 4
-                    infostr += ";%08x" % (extofs)
-                    encdat += dat[o:]
-                tail = encdat[extlen:]
-                encdat = encdat[:extlen]
-                decflags[0] = "+"
-            else:
-                encdat = dat
-                decflags[0] = "*"
+                    # v4, readtad rejects all other versions.
+                    flags = ofs >> 56
+                    # 04 --> data, v3compdata
+                    # 02,03 --> deleted
+                    # 00 --> extrec
+                    ofs &= (1<<56)-1
+
+                dat = readdata(ofs, ln)
+                ranges.append((ofs, ofs + ln, "item #%d" % i))
+                decflags = [" ", " "]
+                infostr = ""
+                tail = b""
+
+                if not dat:
+                    # empty record
+                    encdat = dat
+                elif not flags:
+                    extofs, extlen = exthdr.unpack_from(dat)
+                    infostr = "%08x;%08x" % (extofs, extlen)
+                    encdat = bytearray(dat[hdrlen:])
+                    while len(encdat) < extlen:
+                        dat = readdata(extofs, blocksize)
+                        ranges.append((extofs, extofs + blocksize, "item #%d ext" % i))
+                        (extofs,) = extptr.unpack_from(dat)
+                        infostr += ";%08x" % (extofs)
+                        encdat += dat[ptrlen:]
+                    tail = bytes(encdat[extlen:])
+                    encdat = bytes(encdat[:extlen])
+                    decflags[0] = "+"
+                else:
+                    encdat = dat
+                    decflags[0] = "*"
+
+                yield i, ofs, ln, chk, flags, infostr, tail, encdat, decflags
+
+        def formatrec(rec):
+            """
+            KOD decode, decompress and format a single record.
+            """
+            i, ofs, ln, chk, flags, infostr, tail, encdat, decflags = rec
+            if encdat is None:
+                # deleted record
+                return "%5d: %08x %08x %08x" % (i + 1, ofs, ln, chk)
 
             if self.encoding & 1:
                 if self.kod:
-                    encdat = self.kod.decode(idx, encdat)
+                    encdat = self.kod.decode(i + 1, encdat)
             else:
                 decflags[0] = " "
 
             if args.decompress:
-                if self.iscompressed(encdat):
-                    encdat = self.decompress(encdat)
+                chunks = self.iscompressed(encdat)
+                if chunks:
+                    encdat = self.decompress(encdat, chunks, getattr(args, "verify", False))
                     decflags[1] = "@"
 
             # TODO: separate handling for v4
-            print("%5d: %08x-%08x: (%02x:%08x) %s %s%s %s" % (
+            return "%5d: %08x-%08x: (%02x:%08x) %s %s%s %s" % (
                     i+1, ofs, ofs + ln, flags, chk,
-                    infostr, "".join(decflags), toout(args, encdat), tohex(tail)))
+                    infostr, "".join(decflags), toout(args, encdat), tohex(tail))
+
+        # the raw reads happen on this thread, the decoding and
+        # formatting of the records is spread over the thread pool.
+        # lines are printed in batches: one write per 1000 records
+        # instead of one per record.
+        lines = []
+        for line in self.pipelined(readraw(), formatrec):
+            lines.append(line)
+            if len(lines) >= 1000:
+                print("\n".join(lines))
+                del lines[:]
+        if lines:
+            print("\n".join(lines))
 
         if args.verbose:
             # output parts not referenced in the .tad file.
@@ -300,23 +495,38 @@ class Datafile:
     def iscompressed(self, data):
         """
         Check if this record looks like a compressed record.
+
+        Returns the list of chunk header offsets and sizes when it does,
+        so decompress does not have to parse the chunk table a second time.
         """
         if len(data) < 11:
             return
-        if data[-3:] != b"\x00\x00\x02":
+        # the b"\x00\x00\x02" trailer, checked without slicing.
+        if data[-1] != 2 or data[-2] or data[-3]:
             return
+        chunks = []
         o = 0
-        while o < len(data) - 3:
-            size, flag = struct.unpack_from(">HH", data, o)
+        end = len(data) - 3
+        readheader = chunkheader.unpack_from
+        while o < end:
+            size, flag = readheader(data, o)
             if flag != 0x800 and flag != 0x008:
                 return
+            chunks.append((o, size))
             o += size + 2
-        return True
+        return chunks
 
-    def decompress(self, data):
+    def decompress(self, data, chunks=None, verify=False, limit=None):
         """
         Decompress a record.
 
+        `chunks` is optionally the chunk list as returned by iscompressed,
+        avoiding a second walk over the chunk table.
+        `verify` checks each chunk's stored crc32 against the decompressed
+        data, using zlib's native crc32 implementation.
+        `limit` stops inflating once that many bytes are available, for
+        callers that only need a prefix of a large record.
+
         Compressed records can have several chunks of compressed data.
         Note that the compression header uses a mix of big-endian and little numbers.
 
@@ -329,16 +539,29 @@ class Datafile:
         the crc algorithm is the one labeled 'crc-32' on this page:
             http://crcmod.sourceforge.net/crcmod.predefined.html
         """
-        result = b""
-        o = 0
-        while o < len(data) - 3:
+        if chunks is None:
+            chunks = self.iscompressed(data) or []
+        result = []
+        total = 0
+        view = memoryview(data)
+        for o, size in chunks:
+            if limit is not None and total >= limit:
+                break
             # note the mix of bigendian and little endian numbers here.
-            size, flag = struct.unpack_from(">HH", data, o)
-            storedcrc, = struct.unpack_from("<L", data, o+4)
-
-            C = zlib.decompressobj(-15)
-            result += C.decompress(data[o+8:o+8+size-6])
-            # note that we are not verifying the crc!
-
-            o += size + 2
-        return result
+            # the crc is stored little endian at data[o+4:o+8].
+
+            # each chunk is a complete raw deflate stream, so the stateless
+            # zlib.decompress suffices, saving a decompressobj per chunk.
+            # a memoryview slice, so no per-chunk copy of the input.
+            if limit is not None and not verify:
+                # inflate no more of the final chunk than needed.
+                chunk = zlib.decompressobj(-15).decompress(view[o+8:o+8+size-6], limit - total)
+            else:
+                chunk = zlib.decompress(view[o+8:o+8+size-6], -15)
+            if verify:
+                storedcrc, = struct.unpack_from("<L", data, o+4)
+                if zlib.crc32(chunk) != storedcrc:
+                    print("WARN: crc mismatch in compressed chunk at %08x" % o)
+            result.append(chunk)
+            total += len(chunk)
+        return b"".join(result)
@@ -10,8 +10,11 @@ from sys import exit, stdout
 from os.path import dirname, abspath, join
 from os import mkdir, chdir
 from datetime import datetime
+from contextlib import redirect_stdout
 import base64
 import csv
+import io
+import os
 
 
 def template_convert(kod, args):
@@ -28,13 +31,46 @@ def template_convert(kod, args):
     template_dir = join(dirname(dirname(abspath(__file__))), "templates")
     j2_env = Environment(loader=FileSystemLoader(template_dir))
     j2_templ = j2_env.get_template(args.template + ".j2")
-    j2_templ.stream(db=db, base64=base64).dump(stdout)
+
+    # render lazily with generate() and write the pieces through a large
+    # buffer, instead of a flushing write per template chunk. warnings
+    # printed while rendering are redirected through the same buffer, so
+    # they stay in their usual place in the output.
+    raw = getattr(stdout, "buffer", None)
+    if raw is not None:
+        out = io.TextIOWrapper(io.BufferedWriter(raw, 1024 * 1024),
+                               encoding=stdout.encoding or "utf-8")
+    else:
+        out = stdout
+    write = out.write
+    with redirect_stdout(out):
+        for chunk in j2_templ.generate(db=db, base64=base64):
+            write(chunk)
+    out.flush()
+    if raw is not None:
+        # unhook the wrapper chain from the real stdout, otherwise closing
+        # (or garbage collecting) the wrappers closes sys.stdout.buffer.
+        out.detach().detach()
 
 
 def safepathname(name):
     return name.replace(':', '_').replace('/', '_').replace('\\', '_')
 
 
+def writefile(path, content):
+    """
+    write `content` to a new file, bypassing python's buffered file
+    objects: one os.open, as few os.write syscalls as possible.
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o666)
+    try:
+        view = memoryview(content)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
+
 def csv_output(kod, args):
     """creates a directory with the current timestamp and in it a set of CSV or TSV
        files with all the tables found and an extra directory with all the files"""
@@ -49,7 +85,10 @@ def csv_output(kod, args):
     for table in db.enumerate_tables(files=False):
         tablesafename = safepathname(table.tablename) + ".csv"
 
-        with open(tablesafename, 'w', encoding='utf-8') as csvfile:
+        # write through a large binary buffer, so the many small csv row
+        # writes coalesce into few actual write syscalls.
+        with open(tablesafename, 'wb', buffering=1024 * 1024) as rawfile, \
+                io.TextIOWrapper(rawfile, encoding='utf-8', newline='') as csvfile:
             writer = csv.writer(csvfile, delimiter=args.delimiter, escapechar='\\')
             writer.writerow([field.name for field in table.fields])
 
@@ -65,8 +104,7 @@ def csv_output(kod, args):
         mkdir(filedir)
 
         for system_number, content in db.enumerate_files(table):
-            with open(join(filedir, str(system_number)), "wb") as binfile:
-                binfile.write(content)
+            writefile(join(filedir, str(system_number)), content)
 
     if len(filereferences):
         filedir = "Files-Referenced"
@@ -77,8 +115,7 @@ def csv_output(kod, args):
         if reffile.content:             # only print when file is not NULL
             filesafename = safepathname(reffile.filename) + "." + safepathname(reffile.extname)
             content = db.get_record(reffile.filedatarecord)
-            with open(join("Files-Referenced", filesafename), "wb") as binfile:
-                binfile.write(content)
+            writefile(join("Files-Referenced", filesafename), content)
 
 
 def main():
@@ -210,6 +210,7 @@ def main():
     p.add_argument("--ascdump", "-a", action="store_true")
     p.add_argument("--maxrecs", "-m", type=str, help="max nr or recots to output")
     p.add_argument("--nodecompress", action="store_false", dest="decompress", default="true")
+    p.add_argument("--verify", action="store_true", help="verify the crc32 of decompressed records")
     p.add_argument("dbdir", type=str)
     p.set_defaults(handler=cro_dump)
 
@@ -217,6 +218,7 @@ def main():
     p.add_argument("--verbose", "-v", action="store_true")
     p.add_argument("--ascdump", "-a", action="store_true")
     p.add_argument("--nodecompress", action="store_false", dest="decompress", default="true")
+    p.add_argument("--verify", action="store_true", help="verify the crc32 of decompressed records")
     p.add_argument("dbdir", type=str)
     p.set_defaults(handler=sys_dump)
 
@@ -2,7 +2,7 @@
 Several functions for converting bytes to readable text or hex bytes.
 """
 import struct
-from binascii import b2a_hex, a2b_hex
+from binascii import a2b_hex
 
 
 def unhex(data):
@@ -41,11 +41,16 @@ def aschr(b):
     return "."
 
 
+# table mapping control chars and 0x98 (the only invalid cp1251 byte)
+# to '.', so asasc can translate+decode entire lines at C speed.
+ASCTABLE = bytes(b if 32 <= b < 0x7F or (0x80 <= b and b != 0x98) else 0x2E for b in range(256))
+
+
 def asasc(line):
     """
     convert a CP-1251 encoded byte-array to a line of unicode characters.
     """
-    return "".join(aschr(_) for _ in line)
+    return bytes(line).translate(ASCTABLE).decode("cp1251")
 
 
 def hexdump(ofs, data, args):
@@ -68,7 +73,7 @@ def tohex(data):
     """
     Convert a byte-array to a sequence of 2-digit hex values without separators.
     """
-    return b2a_hex(data).decode("ascii")
+    return bytes(data).hex()
 
 
 def toout(args, data):
@@ -1,6 +1,12 @@
 """
 Decode CroStru KOD encoding.
 """
+try:
+    # numpy is optional, it speeds up decoding of large records considerably.
+    import numpy
+except ImportError:
+    numpy = None
+
 INITIAL_KOD = [
     0x08, 0x63, 0x81, 0x38, 0xA3, 0x6B, 0x82, 0xA6, 0x18, 0x0D, 0xAC, 0xD5, 0xFE, 0xBE, 0x15, 0xF6,
     0xA5, 0x36, 0x76, 0xE2, 0x2D, 0x41, 0xB5, 0x12, 0x4B, 0xD8, 0x3C, 0x56, 0x34, 0x46, 0x4F, 0xA4,
@@ -34,11 +40,18 @@ class KODcoding:
         for i, x in enumerate(self.kod):
             self.inv[x] = i
 
+        self.npkod = numpy.array(self.kod, numpy.uint8) if numpy is not None else None
+
     def decode(self, o, data):
         """
         decode : shift, a[0]..a[n-1] -> b[0]..b[n-1]
             b[i] = KOD[a[i]]- (i+shift)
         """
+        if self.npkod is not None and len(data) > 128:
+            # substitute and shift all bytes in one vectorised pass.
+            a = numpy.frombuffer(data, numpy.uint8)
+            shift = numpy.arange(o, o + len(a), dtype=numpy.int64)
+            return (self.npkod[a] - shift).astype(numpy.uint8).tobytes()
         return bytes((self.kod[b] - i - o) % 256 for i, b in enumerate(data))
 
     def encode(self, o, data):